@@ -1,5 +1,6 @@
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
@@ -7,6 +8,7 @@ from slack_bolt.adapter.socket_mode import SocketModeHandler
 from config import Config
 from state import InMemoryState, RedisState
 from channel_manager import ChannelManager
+from rate_limiter import RateLimitedWebClient
 from slack_logger import SlackLogHandler, SlackLogFilter
 
 logging.basicConfig(
@@ -16,6 +18,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+HELP_BLOCKS = [
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": ":wave: *Need help getting started?*\n\nClick below and someone from our welcome committee will reach out!"
+        }
+    },
+    {
+        "type": "actions",
+        "elements": [
+            {
+                "type": "button",
+                "text": {"type": "plain_text", "text": "Ask for Help"},
+                "style": "primary",
+                "action_id": "request_help",
+            },
+        ],
+    },
+]
+
 
 def main():
     config_errors = Config.validate()
@@ -27,6 +50,10 @@ def main():
     app = App(
         token=Config.SLACK_BOT_TOKEN,
         signing_secret=Config.SLACK_SIGNING_SECRET,
+        listener_executor=ThreadPoolExecutor(
+            max_workers=Config.EVENT_WORKERS,
+            thread_name_prefix="bolt-listener",
+        ),
     )
 
     if Config.REDIS_URL:
@@ -36,10 +63,12 @@ def main():
         state_backend = InMemoryState()
         logger.info("Using in-memory state (set REDIS_URL for persistence)")
 
-    channel_manager = ChannelManager(app.client, state_backend)
+    # Every Slack call goes through client-side rate limits so bursts don't turn into 429s
+    client = RateLimitedWebClient(app.client)
+    channel_manager = ChannelManager(client, state_backend)
 
     if Config.LOG_CHANNEL:
-        slack_handler = SlackLogHandler(app.client, Config.LOG_CHANNEL)
+        slack_handler = SlackLogHandler(client, Config.LOG_CHANNEL)
         slack_handler.addFilter(SlackLogFilter())
         logging.getLogger().addHandler(slack_handler)
         logger.info("Slack log channel enabled")
@@ -55,6 +84,10 @@ def main():
         if not user_id or user.get("is_bot"):
             return
 
+        # Slack redelivers events that were slow to ack, drop the repeats
+        if not state_backend.try_claim_user(user_id):
+            return
+
         # If user is a guest, wait until they become full member
         if user.get("is_restricted") or user.get("is_ultra_restricted"):
             state_backend.add_pending_guest(user_id)
@@ -65,7 +98,7 @@ def main():
             logger.exception("Error processing team_join")
 
     @app.event("member_joined_channel")
-    def handle_member_joined(event: dict, client, logger: logging.Logger):
+    def handle_member_joined(event: dict, logger: logging.Logger):
         if not Config.BOT_ENABLED:
             return
 
@@ -75,33 +108,37 @@ def main():
         if not user_id or not channel_id:
             return
 
-        current_state = state_backend.get_state()
-        is_welcome_channel = channel_id == current_state.current_channel_id
+        is_welcome_channel = channel_id == state_backend.get_current_channel_id()
 
         if not is_welcome_channel:
-            try:
-                info = client.conversations_info(channel=channel_id)
-                channel_name = info["channel"]["name"]
-                is_welcome_channel = Config.is_welcome_channel_name(channel_name)
-            except Exception:
-                pass
+            channel_name = channel_manager.get_channel_name(channel_id)
+            is_welcome_channel = bool(channel_name) and Config.is_welcome_channel_name(channel_name)
 
         if not is_welcome_channel:
             return
 
-        # Only process if user hasn't been handled by team_join
-        if not state_backend.is_user_processed(user_id):
-            try:
-                channel_manager.add_user_to_welcome_channel(user_id)
-            except Exception:
-                logger.exception("Failed to process new user from channel join")
+        # Fails for users team_join already handled as well as for redeliveries
+        if not state_backend.try_claim_user(user_id):
+            return
+
+        try:
+            channel_manager.add_user_to_welcome_channel(user_id)
+        except Exception:
+            logger.exception("Failed to process new user from channel join")
+
+    @app.event("channel_rename")
+    @app.event("group_rename")
+    def handle_channel_rename(event: dict):
+        channel = event.get("channel", {})
+        if channel.get("id") and channel.get("name"):
+            channel_manager.handle_channel_renamed(channel["id"], channel["name"])
 
     @app.event("message")
     def handle_message_events(body, logger):
         pass
 
     @app.action("optin_join")
-    def handle_optin_join(ack, body, client):
+    def handle_optin_join(ack, body):
         ack()
         user_id = body["user"]["id"]
         channel_id = body["actions"][0]["value"]
@@ -121,7 +158,7 @@ def main():
             )
 
     @app.action("optin_decline")
-    def handle_optin_decline(ack, body, client):
+    def handle_optin_decline(ack, body):
         ack()
         client.chat_postEphemeral(
             channel=body["channel"]["id"],
@@ -130,9 +167,9 @@ def main():
         )
 
     @app.command("/helpme")
-    def handle_help_command(ack, body, client, logger):
-        logger.info(f"Received /i-need-help command from {body['user_id']}")
+    def handle_help_command(ack, body, logger):
         ack()
+        logger.info(f"Received /i-need-help command from {body['user_id']}")
         user_id = body["user_id"]
 
         if not Config.WELCOME_COMMITTEE_CHANNEL:
@@ -147,30 +184,11 @@ def main():
             channel=body["channel_id"],
             user=user_id,
             text="Need help?",
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": ":wave: *Need help getting started?*\n\nClick below and someone from our welcome committee will reach out!"
-                    }
-                },
-                {
-                    "type": "actions",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {"type": "plain_text", "text": "Ask for Help"},
-                            "style": "primary",
-                            "action_id": "request_help",
-                        },
-                    ],
-                },
-            ],
+            blocks=HELP_BLOCKS,
         )
 
     @app.action("request_help")
-    def handle_help_request(ack, body, client):
+    def handle_help_request(ack, body):
         ack()
         user_id = body["user"]["id"]
 
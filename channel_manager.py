@@ -1,5 +1,7 @@
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
@@ -8,75 +10,144 @@ from state import StateBackend, BotState
 
 logger = logging.getLogger(__name__)
 
+# How long a channel id -> name lookup is trusted before asking Slack again
+CHANNEL_INFO_TTL = 600
+
+# A full conversations.list scan is reused for this long before paging again
+CHANNEL_LIST_TTL = 3600
+
+# Shared by every event, so this also caps concurrent invites process-wide
+INVITE_WORKERS = 4
+
+
+def _build_optin_blocks(channel_id: str, message: str) -> list[dict]:
+    return [
+        {
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": f"*{message}*\n\nJoin <#{channel_id}>?"}
+        },
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": {"type": "plain_text", "text": "Yes, join!"},
+                    "style": "primary",
+                    "action_id": "optin_join",
+                    "value": channel_id,
+                },
+                {
+                    "type": "button",
+                    "text": {"type": "plain_text", "text": "No thanks"},
+                    "action_id": "optin_decline",
+                    "value": channel_id,
+                },
+            ],
+        },
+    ]
+
 
 class ChannelManager:
     def __init__(self, client: WebClient, state_backend: StateBackend):
         self.client = client
         self.state = state_backend
+        self._channel_names: dict[str, tuple[str, float]] = {}
+        self._joined_channels: set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=INVITE_WORKERS, thread_name_prefix="channel-invite")
+        # Opt-in prompts never change after startup, so build their blocks once
+        self._optin_blocks = {
+            channel_id: _build_optin_blocks(channel_id, message)
+            for channel_id, message in Config.OPTIN_CHANNELS.items()
+        }
+
+    def get_channel_name(self, channel_id: str) -> str | None:
+        cached = self._channel_names.get(channel_id)
+        if cached and time.monotonic() < cached[1]:
+            return cached[0]
+
+        # Any failure, network or a malformed response, just means the channel isn't recognised
+        try:
+            name = self.client.conversations_info(channel=channel_id)["channel"]["name"]
+        except SlackApiError as e:
+            logger.warning(f"Failed to look up channel {channel_id}: {e.response['error']}")
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to look up channel {channel_id}: {e}")
+            return None
+
+        self.cache_channel_name(channel_id, name)
+        return name
+
+    def cache_channel_name(self, channel_id: str, name: str) -> None:
+        self._channel_names[channel_id] = (name, time.monotonic() + CHANNEL_INFO_TTL)
+
+    def handle_channel_renamed(self, channel_id: str, name: str) -> None:
+        self.cache_channel_name(channel_id, name)
+        # Renames are rare, reading the whole map to find the old name is fine
+        old_names = [
+            old_name for old_name, mapped_id in self.state.get_channel_map().items()
+            if mapped_id == channel_id and old_name != name
+        ]
+        self.state.remove_channel_names(old_names)
+        self.state.set_channel_map({name: channel_id})
 
     def add_user_to_default_channels(self, user_id: str) -> None:
-        added = []
-        for channel_id in Config.DEFAULT_CHANNELS:
-            result = self._invite_user(channel_id, user_id)
-            if result and result != "guest":
-                added.append(channel_id)
+        results = self._executor.map(
+            lambda channel_id: self._invite_user(channel_id, user_id),
+            Config.DEFAULT_CHANNELS,
+        )
+        added = [result for result in results if result and result != "guest"]
         if added:
             logger.info(f"Added {user_id} to {len(added)} default channels")
 
     def send_optin_prompts(self, user_id: str) -> None:
-        for channel_id, message in Config.OPTIN_CHANNELS.items():
-            try:
-                self.client.chat_postEphemeral(
-                    channel=Config.OPTIN_PROMPT_CHANNEL,
-                    user=user_id,
-                    text=message,
-                    blocks=[
-                        {
-                            "type": "section",
-                            "text": {"type": "mrkdwn", "text": f"*{message}*\n\nJoin <#{channel_id}>?"}
-                        },
-                        {
-                            "type": "actions",
-                            "elements": [
-                                {
-                                    "type": "button",
-                                    "text": {"type": "plain_text", "text": "Yes, join!"},
-                                    "style": "primary",
-                                    "action_id": "optin_join",
-                                    "value": channel_id,
-                                },
-                                {
-                                    "type": "button",
-                                    "text": {"type": "plain_text", "text": "No thanks"},
-                                    "action_id": "optin_decline",
-                                    "value": channel_id,
-                                },
-                            ],
-                        },
-                    ],
-                )
-            except SlackApiError as e:
-                logger.error(f"Failed to send opt-in prompt: {e.response['error']}")
+        # Drain the iterator so every prompt has been sent when this returns
+        list(self._executor.map(
+            lambda item: self._send_optin_prompt(user_id, *item),
+            Config.OPTIN_CHANNELS.items(),
+        ))
+
+    def _send_optin_prompt(self, user_id: str, channel_id: str, message: str) -> None:
+        try:
+            self.client.chat_postEphemeral(
+                channel=Config.OPTIN_PROMPT_CHANNEL,
+                user=user_id,
+                text=message,
+                blocks=self._optin_blocks[channel_id],
+            )
+        except SlackApiError as e:
+            logger.error(f"Failed to send opt-in prompt: {e.response['error']}")
 
     def process_promoted_guest(self, user_id: str) -> bool:
-        if not self.state.is_pending_guest(user_id):
+        # Overlapping user_change events both see the guest pending, only the one that removes them goes on
+        if not self.state.remove_pending_guest(user_id):
             return False
 
-        self.state.remove_pending_guest(user_id)
         return self.add_user_to_welcome_channel(user_id)
 
     def add_user_to_welcome_channel(self, user_id: str) -> bool:
-        if self.state.is_user_processed(user_id):
+        # Callers gate the user first, with try_claim_user or by removing them from the pending
+        # guests, so this only has to read; the mark is written with the count
+        request = self.state.begin_request(user_id)
+        if request.already_processed:
             return True
 
-        # Mark early to prevent race conditions
-        self.state.mark_user_processed(user_id)
+        # Welcome channel first so the rotation check runs on a fresh state snapshot
+        result = self._invite_to_current_channel(request.state, user_id)
+
+        # Only a committed welcome marks the user processed. A failure may be retried and a
+        # guest goes through here again on promotion, so neither gets the rest of the flow yet
+        if result == "guest":
+            return True
+        if not result:
+            return False
 
         self.add_user_to_default_channels(user_id)
         self.send_optin_prompts(user_id)
 
-        current_state = self.state.get_state()
+        return True
 
+    def _invite_to_current_channel(self, current_state: BotState, user_id: str) -> bool | str:
         if not current_state.current_channel_id:
             current_state = self._create_or_get_channel(current_state)
             if not current_state.current_channel_id:
@@ -94,11 +165,11 @@ class ChannelManager:
 
         if result == "guest":
             logger.info("Guest user will be added to welcome channel after promotion")
-            return True
+            self.state.add_pending_guest(user_id)
+            return "guest"
 
         if result:
-            current_state.current_count += 1
-            self.state.save_state(current_state)
+            current_state = self.state.commit(count_increment=1, newly_processed=[user_id])
             self._send_user_welcome(current_state.current_channel_id, user_id)
             logger.info(f"Welcomed {user_id} to channel {current_state.current_channel_number} ({current_state.current_count}/{Config.BATCH_SIZE})")
         else:
@@ -112,9 +183,9 @@ class ChannelManager:
         try:
             response = self.client.conversations_create(name=channel_name, is_private=True)
             channel_id = response["channel"]["id"]
-            state.current_channel_id = channel_id
-            state.current_count = 0
+            state = replace(state, current_channel_id=channel_id, current_count=0)
             self.state.save_state(state)
+            self.state.set_channel_map({channel_name: channel_id})
             self._post_welcome_message(channel_id)
             self._add_default_members(channel_id)
             logger.info(f"Created new channel: {channel_name}")
@@ -131,6 +202,30 @@ class ChannelManager:
         return state
 
     def _find_existing_channel(self, state: BotState, channel_name: str) -> BotState:
+        channel_id = self.state.get_channel_map().get(channel_name)
+        if channel_id:
+            adopted = self._adopt_channel(state, channel_name, channel_id)
+            if adopted:
+                return adopted
+            logger.info(f"Cached channel {channel_name} is gone or renamed, rescanning channels")
+            self.state.remove_channel_names([channel_name])
+        elif self.state.is_channel_map_fresh():
+            # The scan only sees channels the bot is in, repeating it won't turn this one up
+            logger.warning(f"Channel {channel_name} is not in the recent channel list")
+            return state
+
+        channel_map, complete = self._scan_private_channels()
+        if channel_map:
+            self.state.set_channel_map(channel_map)
+        if complete:
+            self.state.mark_channel_map_fresh(CHANNEL_LIST_TTL)
+
+        if channel_name in channel_map:
+            return self._adopt_channel(state, channel_name, channel_map[channel_name]) or state
+        return state
+
+    def _scan_private_channels(self) -> tuple[dict[str, str], bool]:
+        channel_map = {}
         try:
             cursor = None
             while True:
@@ -152,52 +247,66 @@ class ChannelManager:
                             raise
                 else:
                     logger.error("Failed to list channels after retries")
-                    return state
+                    return channel_map, False
 
                 for channel in response["channels"]:
-                    if channel["name"] == channel_name:
-                        channel_id = channel["id"]
-
-                        if channel.get("is_archived"):
-                            logger.info(f"Channel {channel_name} is archived, unarchiving...")
-                            try:
-                                self.client.conversations_unarchive(channel=channel_id)
-                            except SlackApiError as e:
-                                logger.error(f"Failed to unarchive: {e.response['error']}")
-                                return state
-
-                        self._ensure_bot_in_channel(channel_id)
-                        state.current_channel_id = channel_id
-
-                        info = self.client.conversations_info(channel=channel_id, include_num_members=True)
-                        state.current_count = max(0, info["channel"].get("num_members", 1) - 1)
-                        self.state.save_state(state)
-                        logger.info(f"Found existing channel {channel_name} with {state.current_count} members")
-                        return state
+                    channel_map[channel["name"]] = channel["id"]
 
                 cursor = response.get("response_metadata", {}).get("next_cursor")
                 if not cursor:
-                    break
+                    return channel_map, True
 
+        except SlackApiError as e:
+            logger.error(f"Failed to list channels: {e.response['error']}")
+
+        return channel_map, False
+
+    def _adopt_channel(self, state: BotState, channel_name: str, channel_id: str) -> BotState | None:
+        try:
+            info = self.client.conversations_info(channel=channel_id, include_num_members=True)
         except SlackApiError as e:
             logger.error(f"Failed to find channel: {e.response['error']}")
+            return None
 
+        if info["channel"]["name"] != channel_name:
+            logger.info(f"Channel {channel_id} is now named {info['channel']['name']}, not {channel_name}")
+            return None
+
+        if info["channel"].get("is_archived"):
+            logger.info(f"Channel {channel_name} is archived, unarchiving...")
+            try:
+                self.client.conversations_unarchive(channel=channel_id)
+            except SlackApiError as e:
+                logger.error(f"Failed to unarchive: {e.response['error']}")
+                return None
+
+        self._ensure_bot_in_channel(channel_id)
+        state = replace(
+            state,
+            current_channel_id=channel_id,
+            current_count=max(0, info["channel"].get("num_members", 1) - 1),
+        )
+        self.state.save_state(state)
+        logger.info(f"Found existing channel {channel_name} with {state.current_count} members")
         return state
 
     def _rotate_to_next_channel(self, state: BotState) -> BotState:
-        state.current_channel_number += 1
-        state.current_channel_id = None
-        state.current_count = 0
+        state = replace(state, current_channel_number=state.current_channel_number + 1, current_channel_id=None, current_count=0)
         return self._create_or_get_channel(state)
 
     def _ensure_bot_in_channel(self, channel_id: str) -> bool:
+        if channel_id in self._joined_channels:
+            return True
+
         try:
             self.client.conversations_join(channel=channel_id)
+            self._joined_channels.add(channel_id)
             return True
         except SlackApiError as e:
             error = e.response["error"]
             # Private channels can't be joined - bot must already be member or create it
             if error in ("already_in_channel", "method_not_supported_for_channel_type"):
+                self._joined_channels.add(channel_id)
                 return True
             logger.error(f"Bot failed to join channel {channel_id}: {error}")
             return False
@@ -219,6 +328,10 @@ class ChannelManager:
                 if error == "already_in_channel":
                     return True
 
+                if error == "not_in_channel":
+                    # Bot was removed since it last joined, rejoin on the next invite
+                    self._joined_channels.discard(channel_id)
+
                 if error == "ratelimited":
                     retry_after = int(e.response.headers.get("Retry-After", 2 ** attempt))
                     logger.warning(f"Rate limited, waiting {retry_after}s")
@@ -1,3 +1,4 @@
+import functools
 import os
 from dotenv import load_dotenv
 from messages import WELCOME_MESSAGE
@@ -13,7 +14,11 @@ class Config:
     BOT_ENABLED: bool = os.environ.get("BOT_ENABLED", "true").lower() == "true"
     BATCH_SIZE: int = int(os.environ.get("BATCH_SIZE", "1000"))
 
+    # Threads running Bolt listeners, events are acked before a listener runs. 5 is Bolt's own default
+    EVENT_WORKERS: int = int(os.environ.get("EVENT_WORKERS", "5"))
+
     CHANNEL_PREFIX: str = os.environ.get("CHANNEL_PREFIX", "welcome")
+    CHANNEL_PREFIX_DASH: str = CHANNEL_PREFIX + "-"
 
     WELCOME_MESSAGE: str = WELCOME_MESSAGE
 
@@ -45,16 +50,15 @@ class Config:
     ]
 
     @classmethod
+    @functools.lru_cache(maxsize=128)
     def get_channel_name(cls, number: int) -> str:
         if number == 1:
             return cls.CHANNEL_PREFIX
-        return f"{cls.CHANNEL_PREFIX}-{number - 1}"
+        return f"{cls.CHANNEL_PREFIX_DASH}{number - 1}"
 
     @classmethod
     def is_welcome_channel_name(cls, name: str) -> bool:
-        if name == cls.CHANNEL_PREFIX:
-            return True
-        return name.startswith(f"{cls.CHANNEL_PREFIX}-")
+        return name == cls.CHANNEL_PREFIX or name.startswith(cls.CHANNEL_PREFIX_DASH)
 
     @classmethod
     def validate(cls) -> list[str]:
@@ -65,4 +69,6 @@ class Config:
             errors.append("SLACK_SIGNING_SECRET is required")
         if cls.BATCH_SIZE < 1:
             errors.append("BATCH_SIZE must be at least 1")
+        if cls.EVENT_WORKERS < 1:
+            errors.append("EVENT_WORKERS must be at least 1")
         return errors
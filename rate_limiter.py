@@ -0,0 +1,106 @@
+import functools
+import threading
+import time
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+# Calls per minute for each of Slack's rate limit tiers
+TIER_LIMITS = {1: 1, 2: 20, 3: 50, 4: 100}
+
+METHOD_TIERS = {
+    "conversations_create": 2,
+    "conversations_list": 2,
+    "conversations_unarchive": 2,
+    "pins_add": 2,
+    "usergroups_users_list": 2,
+    "conversations_info": 3,
+    "conversations_invite": 3,
+    "conversations_join": 3,
+    "chat_postEphemeral": 4,
+}
+
+# Methods limited per channel rather than per workspace, in calls per minute
+PER_CHANNEL_LIMITS = {
+    "chat_postMessage": 60,
+}
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        # Reserve a token now and sleep outside the lock, callers queue up in order
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            blocked_until = self._blocked_until
+            # This caller's place in the queue, as time after the block (or now)
+            offset = max(0.0, -self._tokens) / self.rate
+            wait = max(0.0, blocked_until - now) + offset
+        while wait > 0:
+            time.sleep(wait)
+            # A 429 while asleep moves the block, keep the same place in line behind it
+            with self._lock:
+                if self._blocked_until <= blocked_until:
+                    return
+                blocked_until = self._blocked_until
+                wait = blocked_until - time.monotonic() + offset
+
+    def cool_off(self, seconds: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = min(self._tokens, 0.0)
+            self._updated = self._blocked_until
+
+    def _refill(self, now: float) -> None:
+        # _updated sits in the future while blocked, nothing refills until the block ends
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+
+class RateLimitedWebClient:
+    def __init__(self, client: WebClient):
+        self._client = client
+        self._buckets = {name: TokenBucket(TIER_LIMITS[tier]) for name, tier in METHOD_TIERS.items()}
+        self._channel_buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name not in self._buckets and name not in PER_CHANNEL_LIMITS:
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            bucket = self._get_bucket(name, kwargs.get("channel"))
+            bucket.acquire()
+            try:
+                return attr(*args, **kwargs)
+            except SlackApiError as e:
+                if e.response["error"] == "ratelimited":
+                    bucket.cool_off(int(e.response.headers.get("Retry-After", 1)))
+                raise
+
+        return call
+
+    def _get_bucket(self, name: str, channel: str | None) -> TokenBucket:
+        if name not in PER_CHANNEL_LIMITS:
+            return self._buckets[name]
+
+        key = (name, channel or "")
+        with self._lock:
+            bucket = self._channel_buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(PER_CHANNEL_LIMITS[name])
+                self._channel_buckets[key] = bucket
+            return bucket
@@ -1,19 +1,48 @@
 import logging
+import queue
 import re
+import sys
+import threading
+import time
+import traceback
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
-SKIP_PATTERNS = [
-    r"Rate limited, waiting",
-]
+# Matched against the unformatted record.msg so dropped records are never %-formatted
+SKIP_PREFIXES = (
+    "Rate limited, waiting",
+)
 
-SKIP_REGEX = re.compile("|".join(SKIP_PATTERNS))
+# Only for entries that need a wildcard, everything else belongs in SKIP_PREFIXES
+SKIP_PATTERNS: list[str] = []
+
+SKIP_REGEX = re.compile("|".join(SKIP_PATTERNS)) if SKIP_PATTERNS else None
+
+# Records are coalesced for this long before being posted as one message
+BATCH_INTERVAL = 1.0
+# Slack rejects section blocks with more than 3000 characters of text
+MAX_BLOCK_CHARS = 3000
+# Records held while Slack is slow or rate limiting, past this the oldest are dropped
+MAX_QUEUED_RECORDS = 1000
+# How long flush() and close() wait for queued records to be posted
+FLUSH_TIMEOUT = 5.0
+
+LEVEL_EMOJI = {
+    logging.CRITICAL: ":x:",
+    logging.ERROR: ":x:",
+    logging.WARNING: ":warning:",
+}
 
 
 class SlackLogFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
         if record.levelno >= logging.WARNING:
             return True
+        msg = record.msg if isinstance(record.msg, str) else str(record.msg)
+        if msg.startswith(SKIP_PREFIXES):
+            return False
+        if SKIP_REGEX is None:
+            return True
         return not SKIP_REGEX.search(record.getMessage())
 
 
@@ -22,33 +51,115 @@ class SlackLogHandler(logging.Handler):
         super().__init__(level)
         self.client = client
         self.channel_id = channel_id
-        self.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        self.queue: queue.Queue[tuple[int, str, str]] = queue.Queue(maxsize=MAX_QUEUED_RECORDS)
+        self._worker = threading.Thread(target=self._drain, name="slack-log-handler", daemon=True)
+        self._worker.start()
 
     def emit(self, record: logging.LogRecord) -> None:
+        # Never block the caller on Slack, the worker thread does the posting
         try:
-            message = self.format(record)
-            emoji = self._get_emoji(record.levelno)
-            self.client.chat_postMessage(
-                channel=self.channel_id,
-                text=f"{emoji} `{record.levelname}` {record.getMessage()}",
-                blocks=[
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"{emoji} *{record.levelname}*\n```{message}```",
-                        },
-                    }
-                ],
-            )
-        except SlackApiError:
-            pass
+            item = (record.levelno, record.levelname, self._format(record))
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    self._drop_oldest()
         except Exception:
             self.handleError(record)
 
-    def _get_emoji(self, level: int) -> str:
-        if level >= logging.ERROR:
-            return ":x:"
-        if level >= logging.WARNING:
-            return ":warning:"
-        return ":information_source:"
+    def _drop_oldest(self) -> None:
+        try:
+            self.queue.get_nowait()
+        except queue.Empty:
+            return
+        self.queue.task_done()
+
+    def flush(self) -> None:
+        # Called by logging.shutdown() before close(), wait a bounded time for the backlog
+        deadline = time.monotonic() + FLUSH_TIMEOUT
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self.queue.all_tasks_done.wait(remaining)
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+    def _format(self, record: logging.LogRecord) -> str:
+        # Same layout as the stdout formatter without going through logging.Formatter
+        created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        message = f"{created},{int(record.msecs):03d} - {record.name} - {record.levelname} - {record.getMessage()}"
+        if record.exc_info:
+            message = f"{message}\n{''.join(traceback.format_exception(*record.exc_info)).rstrip()}"
+        return message
+
+    def _drain(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + BATCH_INTERVAL
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._post_batch(batch)
+            except Exception:
+                if logging.raiseExceptions:
+                    traceback.print_exc(file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _post_batch(self, batch: list[tuple[int, str, str]]) -> None:
+        groups: dict[int, tuple[str, list[str]]] = {}
+        for levelno, levelname, message in batch:
+            groups.setdefault(levelno, (levelname, []))[1].append(message)
+
+        for levelno in sorted(groups, reverse=True):
+            levelname, messages = groups[levelno]
+            emoji = LEVEL_EMOJI.get(levelno, ":information_source:")
+            header = f"{emoji} *{levelname}*\n"
+            for chunk in self._chunk(messages, MAX_BLOCK_CHARS - len(header) - 6):
+                first_line = chunk.split("\n", 1)[0]
+                self._post(
+                    text=f"{emoji} `{levelname}` {first_line}",
+                    block_text=f"{header}```{chunk}```",
+                )
+
+    def _chunk(self, messages: list[str], limit: int) -> list[str]:
+        chunks = []
+        current = ""
+        for message in messages:
+            message = message[:limit]
+            if current and len(current) + 1 + len(message) > limit:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n{message}" if current else message
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def _post(self, text: str, block_text: str) -> None:
+        while True:
+            try:
+                self.client.chat_postMessage(
+                    channel=self.channel_id,
+                    text=text,
+                    blocks=[
+                        {
+                            "type": "section",
+                            "text": {"type": "mrkdwn", "text": block_text},
+                        }
+                    ],
+                )
+                return
+            except SlackApiError as e:
+                if e.response["error"] != "ratelimited":
+                    return
+                time.sleep(int(e.response.headers.get("Retry-After", 1)))
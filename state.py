@@ -1,104 +1,541 @@
-from dataclasses import dataclass, field
+import atexit
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, replace
 from threading import Lock
-from typing import Protocol
+from typing import Iterable, Protocol, Sequence
 
 import redis
 
+logger = logging.getLogger(__name__)
 
-@dataclass
+# Users remembered locally so repeat checks for the same user skip Redis
+MEMBERSHIP_CACHE_SIZE = 10_000
+
+# Caps sockets per process, well above the EVENT_WORKERS listener threads plus the pubsub thread.
+# Extra callers wait up to REDIS_POOL_TIMEOUT for a free one
+REDIS_MAX_CONNECTIONS = 32
+REDIS_POOL_TIMEOUT = 10
+
+# Pause before the pubsub thread retries after losing its connection
+PUBSUB_RETRY_DELAY = 1
+
+# How long close() waits for the pubsub thread to finish its current poll
+PUBSUB_JOIN_TIMEOUT = 5
+
+_redis_pools: dict[str, redis.BlockingConnectionPool] = {}
+# Live RedisState instances per pool, the pool is only disconnected once the last one closes
+_redis_pool_users: dict[str, int] = {}
+_redis_pools_lock = Lock()
+
+
+def _get_redis_pool(redis_url: str) -> redis.BlockingConnectionPool:
+    # One pool per URL for the whole process so connections are reused across events
+    with _redis_pools_lock:
+        pool = _redis_pools.get(redis_url)
+        if pool is None:
+            pool = _create_redis_pool(redis_url)
+            _redis_pools[redis_url] = pool
+        _redis_pool_users[redis_url] = _redis_pool_users.get(redis_url, 0) + 1
+        return pool
+
+
+def _release_redis_pool(redis_url: str) -> None:
+    with _redis_pools_lock:
+        _redis_pool_users[redis_url] -= 1
+        if _redis_pool_users[redis_url] > 0:
+            return
+        del _redis_pool_users[redis_url]
+        pool = _redis_pools.pop(redis_url)
+    pool.disconnect()
+
+
+def _create_redis_pool(redis_url: str) -> redis.BlockingConnectionPool:
+    options = {}
+    # Keepalive only exists for TCP, unix:// URLs get a unix socket connection without it
+    if not redis_url.startswith("unix://"):
+        options["socket_keepalive"] = True
+    return redis.BlockingConnectionPool.from_url(
+        redis_url,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=2,
+        # Ping idle connections before reuse so half-open sockets behind NAT are replaced
+        health_check_interval=30,
+        # Replies stay bytes; RedisState decodes the few string values it returns,
+        # SISMEMBER/SADD/EXISTS replies are plain ints and need no decoding at all
+        decode_responses=False,
+        **options,
+    )
+
+
+def _pack_user_id(user_id: str) -> int:
+    # Slack IDs are uppercase base-36 text, as ints they hash faster and take less memory.
+    # The whole ID is packed, not just the part after the U/W prefix, so U.. and W.. never collide
+    return int(user_id, 36)
+
+
+# Thread-safe set that forgets its least recently used entries past max_size
+class _LRUSet:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[str, None] = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, item: str) -> bool:
+        with self._lock:
+            if item not in self._items:
+                return False
+            self._items.move_to_end(item)
+            return True
+
+    def add(self, item: str) -> None:
+        with self._lock:
+            self._items[item] = None
+            self._items.move_to_end(item)
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, item: str) -> None:
+        with self._lock:
+            self._items.pop(item, None)
+
+
+# Claims a user unless they're already processed, in one round trip and atomically across workers
+CLAIM_USER_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+if redis.call('SET', KEYS[2], 1, 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# Hash fields of welcome_bot:state, in the order _parse_state unpacks them
+STATE_FIELDS = ("channel_number", "channel_id", "count")
+
+
+# Frozen, so a snapshot can be shared and cached without copying, changes go through dataclasses.replace
+@dataclass(slots=True, frozen=True)
 class BotState:
     current_channel_number: int = 1
     current_channel_id: str | None = None
     current_count: int = 0
-    processed_users: set[str] = field(default_factory=set)
-    pending_guests: set[str] = field(default_factory=set)
+
+
+@dataclass(slots=True, frozen=True)
+class RequestContext:
+    already_processed: bool
+    state: BotState
 
 
 class StateBackend(Protocol):
     def get_state(self) -> BotState: ...
+    def get_current_channel_id(self) -> str | None: ...
     def save_state(self, state: BotState) -> None: ...
+    def begin_request(self, user_id: str) -> RequestContext: ...
+    def commit(
+        self, count_increment: int = 0, newly_processed: Sequence[str] = (), newly_pending: Sequence[str] = ()
+    ) -> BotState: ...
+    def try_claim_user(self, user_id: str, ttl: int = 60) -> bool: ...
     def mark_user_processed(self, user_id: str) -> None: ...
     def unmark_user_processed(self, user_id: str) -> None: ...
+    def mark_users_processed(self, user_ids: Iterable[str]) -> None: ...
+    def unmark_users_processed(self, user_ids: Iterable[str]) -> None: ...
     def is_user_processed(self, user_id: str) -> bool: ...
+    def are_users_processed(self, user_ids: list[str]) -> list[bool]: ...
     def add_pending_guest(self, user_id: str) -> None: ...
-    def remove_pending_guest(self, user_id: str) -> None: ...
+    def remove_pending_guest(self, user_id: str) -> bool: ...
+    def add_pending_guests(self, user_ids: Iterable[str]) -> None: ...
+    def remove_pending_guests(self, user_ids: Iterable[str]) -> None: ...
     def is_pending_guest(self, user_id: str) -> bool: ...
+    def are_pending_guests(self, user_ids: list[str]) -> list[bool]: ...
+    def get_channel_map(self) -> dict[str, str]: ...
+    def set_channel_map(self, channel_map: dict[str, str]) -> None: ...
+    def remove_channel_names(self, names: Iterable[str]) -> None: ...
+    def is_channel_map_fresh(self) -> bool: ...
+    def mark_channel_map_fresh(self, ttl: int) -> None: ...
 
 
 class RedisState:
     def __init__(self, redis_url: str):
-        self.redis = redis.from_url(redis_url, decode_responses=True)
+        self.redis_url = redis_url
+        self.pool = _get_redis_pool(redis_url)
+        self.redis = redis.Redis(connection_pool=self.pool)
         self.state_key = "welcome_bot:state"
         self.processed_key = "welcome_bot:processed"
         self.pending_key = "welcome_bot:pending_guests"
+        self.channels_key = "welcome_bot:channels"
+        self.channels_fresh_key = "welcome_bot:channels_fresh"
+        self.claim_prefix = "welcome_bot:claim:"
+        self.state_changed_channel = "welcome_bot:state_changed"
+        self._claim_user = self.redis.register_script(CLAIM_USER_SCRIPT)
+        # Last known state, other instances invalidate it by publishing on state_changed_channel
+        self._cached_state: BotState | None = None
+        self._instance_id = uuid.uuid4().hex.encode()
+        # Last state this instance wrote, identical saves are skipped
+        self._last_saved: BotState | None = None
+        # Bumped on every invalidation. A snapshot read or written before a bump is stale
+        # and must not be stored, the lock makes the check and the store one step
+        self._state_generation = 0
+        self._state_cache_lock = Lock()
+        # Only positive answers are cached, every change made through this backend updates them.
+        # Pending guests aren't cached: promotions remove them on any instance, and the set is small
+        self._processed_cache = _LRUSet(MEMBERSHIP_CACHE_SIZE)
+        self._closed = False
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            # The first network I/O, if Redis is unreachable give the pool reference back
+            self._pubsub.subscribe(**{self.state_changed_channel: self._on_state_changed})
+            self._pubsub_thread = self._pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=self._on_pubsub_error
+            )
+        except BaseException:
+            self._pubsub.close()
+            _release_redis_pool(redis_url)
+            raise
+        # Safety net for callers that never close, so sockets aren't left half-open on exit
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        # Unregistered so a closed instance isn't kept alive by atexit until shutdown
+        atexit.unregister(self.close)
+        # stop() only clears a flag, wait for the thread to leave get_message before closing
+        self._pubsub_thread.stop()
+        self._pubsub_thread.join(timeout=PUBSUB_JOIN_TIMEOUT)
+        self._pubsub.close()
+        self.redis.close()
+        # Other instances on the same URL share the pool, only the last one disconnects it
+        _release_redis_pool(self.redis_url)
+
+    def __enter__(self) -> "RedisState":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     def get_state(self) -> BotState:
-        data = self.redis.hgetall(self.state_key)
-        return BotState(
-            current_channel_number=int(data.get("channel_number", 1)),
-            current_channel_id=data.get("channel_id") or None,
-            current_count=int(data.get("count", 0)),
-        )
+        cached = self._cached_state
+        if cached is None:
+            generation = self._state_generation
+            cached = self._parse_state(self.redis.hmget(self.state_key, STATE_FIELDS))
+            self._store_snapshot(cached, generation)
+        return cached
 
-    def save_state(self, state: BotState) -> None:
-        self.redis.hset(self.state_key, mapping={
+    def _store_snapshot(self, state: BotState, generation: int, saved: bool = False) -> None:
+        with self._state_cache_lock:
+            if generation != self._state_generation:
+                return
+            self._cached_state = state
+            if saved:
+                self._last_saved = state
+
+    def _invalidate_state(self) -> None:
+        with self._state_cache_lock:
+            self._state_generation += 1
+            self._cached_state = None
+            self._last_saved = None
+
+    def _on_state_changed(self, message: dict) -> None:
+        if message["data"] != self._instance_id:
+            self._invalidate_state()
+
+    def _on_pubsub_error(self, error: BaseException, pubsub, thread) -> None:
+        # Changes published while disconnected are lost, so drop what they would have invalidated.
+        # The thread keeps running, its next get_message reconnects and resubscribes
+        logger.warning(f"State change subscription failed, retrying: {error}")
+        self._invalidate_state()
+        time.sleep(PUBSUB_RETRY_DELAY)
+
+    def _state_mapping(self, state: BotState) -> dict:
+        return {
             "channel_number": state.current_channel_number,
             "channel_id": state.current_channel_id or "",
             "count": state.current_count,
-        })
+        }
+
+    def _parse_state(self, values: list[bytes | None]) -> BotState:
+        channel_number, channel_id, count = values
+        # int() parses ASCII digits straight from bytes, only the channel id needs decoding
+        return BotState(
+            current_channel_number=int(channel_number or 1),
+            current_channel_id=channel_id.decode() if channel_id else None,
+            current_count=int(count or 0),
+        )
+
+    def get_current_channel_id(self) -> str | None:
+        # Checked on every channel join, served from the cached snapshot
+        return self.get_state().current_channel_id
+
+    def save_state(self, state: BotState) -> None:
+        if state == self._last_saved:
+            return
+        generation = self._state_generation
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self.state_key, mapping=self._state_mapping(state))
+            pipe.publish(self.state_changed_channel, self._instance_id)
+            pipe.execute()
+        self._store_snapshot(state, generation, saved=True)
+
+    def begin_request(self, user_id: str) -> RequestContext:
+        generation = self._state_generation
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.sismember(self.processed_key, user_id)
+            pipe.hmget(self.state_key, STATE_FIELDS)
+            processed, values = pipe.execute()
+        if processed:
+            self._processed_cache.add(user_id)
+        # The welcome path always reads fresh state since it decides on rotation from the count
+        state = self._parse_state(values)
+        self._store_snapshot(state, generation)
+        return RequestContext(already_processed=bool(processed), state=state)
+
+    def commit(
+        self, count_increment: int = 0, newly_processed: Sequence[str] = (), newly_pending: Sequence[str] = ()
+    ) -> BotState:
+        # Count and membership change together in one MULTI/EXEC. The count is incremented in
+        # Redis rather than written back, so concurrent welcomes can't overwrite each other
+        generation = self._state_generation
+        with self.redis.pipeline(transaction=True) as pipe:
+            if count_increment:
+                pipe.hincrby(self.state_key, "count", count_increment)
+            if newly_processed:
+                pipe.sadd(self.processed_key, *newly_processed)
+            if newly_pending:
+                pipe.sadd(self.pending_key, *newly_pending)
+            pipe.publish(self.state_changed_channel, self._instance_id)
+            pipe.hmget(self.state_key, STATE_FIELDS)
+            state = self._parse_state(pipe.execute()[-1])
+        self._store_snapshot(state, generation, saved=True)
+        for user_id in newly_processed:
+            self._processed_cache.add(user_id)
+        return state
+
+    def try_claim_user(self, user_id: str, ttl: int = 60) -> bool:
+        claim_key = f"{self.claim_prefix}{user_id}"
+        if user_id in self._processed_cache:
+            return False
+        return self._claim_user(keys=[self.processed_key, claim_key], args=[user_id, ttl]) == 1
 
     def mark_user_processed(self, user_id: str) -> None:
         self.redis.sadd(self.processed_key, user_id)
+        self._processed_cache.add(user_id)
 
     def unmark_user_processed(self, user_id: str) -> None:
         self.redis.srem(self.processed_key, user_id)
+        self._processed_cache.discard(user_id)
+
+    def mark_users_processed(self, user_ids: Iterable[str]) -> None:
+        # One variadic SADD instead of a command per user
+        user_ids = list(user_ids)
+        if user_ids:
+            self.redis.sadd(self.processed_key, *user_ids)
+            for user_id in user_ids:
+                self._processed_cache.add(user_id)
+
+    def unmark_users_processed(self, user_ids: Iterable[str]) -> None:
+        user_ids = list(user_ids)
+        if user_ids:
+            self.redis.srem(self.processed_key, *user_ids)
+            for user_id in user_ids:
+                self._processed_cache.discard(user_id)
 
     def is_user_processed(self, user_id: str) -> bool:
-        return self.redis.sismember(self.processed_key, user_id)
+        if user_id in self._processed_cache:
+            return True
+        is_member = bool(self.redis.sismember(self.processed_key, user_id))
+        if is_member:
+            self._processed_cache.add(user_id)
+        return is_member
+
+    def are_users_processed(self, user_ids: list[str]) -> list[bool]:
+        return self._are_members(self.processed_key, user_ids, self._processed_cache)
 
     def add_pending_guest(self, user_id: str) -> None:
         self.redis.sadd(self.pending_key, user_id)
 
-    def remove_pending_guest(self, user_id: str) -> None:
-        self.redis.srem(self.pending_key, user_id)
+    def remove_pending_guest(self, user_id: str) -> bool:
+        # SREM's count says whether this call removed them, so only one caller wins a promotion
+        return bool(self.redis.srem(self.pending_key, user_id))
+
+    def add_pending_guests(self, user_ids: Iterable[str]) -> None:
+        user_ids = list(user_ids)
+        if user_ids:
+            self.redis.sadd(self.pending_key, *user_ids)
+
+    def remove_pending_guests(self, user_ids: Iterable[str]) -> None:
+        user_ids = list(user_ids)
+        if user_ids:
+            self.redis.srem(self.pending_key, *user_ids)
 
     def is_pending_guest(self, user_id: str) -> bool:
-        return self.redis.sismember(self.pending_key, user_id)
+        return bool(self.redis.sismember(self.pending_key, user_id))
+
+    def are_pending_guests(self, user_ids: list[str]) -> list[bool]:
+        return self._are_members(self.pending_key, user_ids)
+
+    def _are_members(self, key: str, user_ids: list[str], cache: _LRUSet | None = None) -> list[bool]:
+        results = {user_id: True for user_id in user_ids if cache is not None and user_id in cache}
+        misses = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in results]
+        if misses:
+            try:
+                answers = self.redis.smismember(key, misses)
+            except redis.ResponseError:
+                # SMISMEMBER needs Redis 6.2, older servers still get a single round-trip
+                with self.redis.pipeline(transaction=False) as pipe:
+                    for user_id in misses:
+                        pipe.sismember(key, user_id)
+                    answers = pipe.execute()
+            for user_id, answer in zip(misses, answers):
+                results[user_id] = bool(answer)
+                if answer and cache is not None:
+                    cache.add(user_id)
+        return [results[user_id] for user_id in user_ids]
+
+    def get_channel_map(self) -> dict[str, str]:
+        channel_map = self.redis.hgetall(self.channels_key)
+        return {name.decode(): channel_id.decode() for name, channel_id in channel_map.items()}
+
+    def set_channel_map(self, channel_map: dict[str, str]) -> None:
+        if channel_map:
+            self.redis.hset(self.channels_key, mapping=channel_map)
+
+    def remove_channel_names(self, names: Iterable[str]) -> None:
+        names = list(names)
+        if names:
+            self.redis.hdel(self.channels_key, *names)
+
+    def is_channel_map_fresh(self) -> bool:
+        return bool(self.redis.exists(self.channels_fresh_key))
+
+    def mark_channel_map_fresh(self, ttl: int) -> None:
+        self.redis.set(self.channels_fresh_key, 1, ex=ttl)
 
 
 class InMemoryState:
     def __init__(self):
         self._state = BotState()
-        self._lock = Lock()
+        # Kept beside BotState, not in it, so get_state stays a few scalars like RedisState.
+        # Copy-on-write frozensets: writers rebind under the lock, readers never lock
+        self._processed_users: frozenset[int] = frozenset()
+        self._pending_guests: frozenset[int] = frozenset()
+        self._channel_map: dict[str, str] = {}
+        self._claims: dict[str, float] = {}
+        self._channel_map_expires = 0.0
+        # One lock per structure so unrelated writes never wait on each other
+        self._state_lock = Lock()
+        self._processed_lock = Lock()
+        self._pending_lock = Lock()
+        self._claims_lock = Lock()
+        self._channel_map_lock = Lock()
 
+    # Reads skip the lock, they only load an attribute that writers replace wholesale
     def get_state(self) -> BotState:
-        with self._lock:
-            return self._state
+        return self._state
+
+    def get_current_channel_id(self) -> str | None:
+        return self._state.current_channel_id
 
     def save_state(self, state: BotState) -> None:
-        with self._lock:
+        with self._state_lock:
             self._state = state
 
+    def begin_request(self, user_id: str) -> RequestContext:
+        return RequestContext(already_processed=_pack_user_id(user_id) in self._processed_users, state=self._state)
+
+    def commit(
+        self, count_increment: int = 0, newly_processed: Sequence[str] = (), newly_pending: Sequence[str] = ()
+    ) -> BotState:
+        # Always taken in this order so writers can't deadlock
+        with self._state_lock, self._processed_lock, self._pending_lock:
+            self._state = replace(self._state, current_count=self._state.current_count + count_increment)
+            self._processed_users = self._processed_users.union(map(_pack_user_id, newly_processed))
+            self._pending_guests = self._pending_guests.union(map(_pack_user_id, newly_pending))
+            return self._state
+
+    def try_claim_user(self, user_id: str, ttl: int = 60) -> bool:
+        if _pack_user_id(user_id) in self._processed_users:
+            return False
+        now = time.monotonic()
+        with self._claims_lock:
+            if self._claims.get(user_id, 0) > now:
+                return False
+            if len(self._claims) > 1000:
+                self._claims = {u: t for u, t in self._claims.items() if t > now}
+            self._claims[user_id] = now + ttl
+            return True
+
     def mark_user_processed(self, user_id: str) -> None:
-        with self._lock:
-            self._state.processed_users.add(user_id)
+        with self._processed_lock:
+            self._processed_users = self._processed_users | {_pack_user_id(user_id)}
 
     def unmark_user_processed(self, user_id: str) -> None:
-        with self._lock:
-            self._state.processed_users.discard(user_id)
+        with self._processed_lock:
+            self._processed_users = self._processed_users - {_pack_user_id(user_id)}
+
+    def mark_users_processed(self, user_ids: Iterable[str]) -> None:
+        with self._processed_lock:
+            self._processed_users = self._processed_users.union(map(_pack_user_id, user_ids))
+
+    def unmark_users_processed(self, user_ids: Iterable[str]) -> None:
+        with self._processed_lock:
+            self._processed_users = self._processed_users.difference(map(_pack_user_id, user_ids))
 
     def is_user_processed(self, user_id: str) -> bool:
-        with self._lock:
-            return user_id in self._state.processed_users
+        return _pack_user_id(user_id) in self._processed_users
+
+    def are_users_processed(self, user_ids: list[str]) -> list[bool]:
+        processed_users = self._processed_users
+        return [_pack_user_id(user_id) in processed_users for user_id in user_ids]
 
     def add_pending_guest(self, user_id: str) -> None:
-        with self._lock:
-            self._state.pending_guests.add(user_id)
+        with self._pending_lock:
+            self._pending_guests = self._pending_guests | {_pack_user_id(user_id)}
 
-    def remove_pending_guest(self, user_id: str) -> None:
-        with self._lock:
-            self._state.pending_guests.discard(user_id)
+    def remove_pending_guest(self, user_id: str) -> bool:
+        packed = _pack_user_id(user_id)
+        with self._pending_lock:
+            if packed not in self._pending_guests:
+                return False
+            self._pending_guests = self._pending_guests - {packed}
+            return True
+
+    def add_pending_guests(self, user_ids: Iterable[str]) -> None:
+        with self._pending_lock:
+            self._pending_guests = self._pending_guests.union(map(_pack_user_id, user_ids))
+
+    def remove_pending_guests(self, user_ids: Iterable[str]) -> None:
+        with self._pending_lock:
+            self._pending_guests = self._pending_guests.difference(map(_pack_user_id, user_ids))
 
     def is_pending_guest(self, user_id: str) -> bool:
-        with self._lock:
-            return user_id in self._state.pending_guests
+        return _pack_user_id(user_id) in self._pending_guests
+
+    def are_pending_guests(self, user_ids: list[str]) -> list[bool]:
+        pending_guests = self._pending_guests
+        return [_pack_user_id(user_id) in pending_guests for user_id in user_ids]
+
+    def get_channel_map(self) -> dict[str, str]:
+        with self._channel_map_lock:
+            return dict(self._channel_map)
+
+    def set_channel_map(self, channel_map: dict[str, str]) -> None:
+        with self._channel_map_lock:
+            self._channel_map.update(channel_map)
+
+    def remove_channel_names(self, names: Iterable[str]) -> None:
+        with self._channel_map_lock:
+            for name in names:
+                self._channel_map.pop(name, None)
+
+    def is_channel_map_fresh(self) -> bool:
+        return time.monotonic() < self._channel_map_expires
+
+    def mark_channel_map_fresh(self, ttl: int) -> None:
+        self._channel_map_expires = time.monotonic() + ttl